@@ -0,0 +1,143 @@
+"""
+Measure bytes transferred and server time for dashboard visits with and without HTTP caching.
+
+Usage:
+    python -m benchmarks.bench_http_cache [--jobs 50] [--requests 200] [--before-rev REV] [--brotli]
+
+Uses the Flask test client with the Google OAuth session replaced by a stub that is
+always signed in, so only the app's own work is timed. The "before" numbers come
+from a checkout of --before-rev (by default the repository's first commit), run in
+a separate process with the same stub. Clients send "Accept-Encoding: gzip" unless
+--brotli is given, since brotli is an optional dependency.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USER = "bench@example.com"
+ASSETS = ("css/brand.css", "style.css", "tagify.js", "logo.svg")
+
+
+class StubGoogle:
+    """Stand-in for the flask_dance google proxy with a signed-in user."""
+    authorized = True
+    token = {"access_token": "ya29.bench"}
+
+    class _UserInfo:
+        ok = True
+        status_code = 200
+        text = ""
+
+        def json(self):
+            return {"email": USER}
+
+    def get(self, url):
+        return self._UserInfo()
+
+
+def timed(client, path, headers):
+    started = time.perf_counter()
+    resp = client.get(path, headers=headers)
+    elapsed = time.perf_counter() - started
+    return resp, elapsed
+
+
+def load_app(root: str, jobs: int):
+    """Import the app found under root against a fresh database holding the user's jobs."""
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    os.environ["DB_PATH"] = f"sqlite:///{os.path.join(workdir, 'jobs.db')}"
+    sys.path.insert(0, root)
+    import src.app as web
+    from src.models.models import ScheduledJob, Session
+    web.google = StubGoogle()
+
+    session = Session()
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    for i in range(jobs):
+        session.add(ScheduledJob(id=str(uuid.uuid4()), user_email=USER, to_address=f"r{i}@example.com",
+                                 subject=f"Weekly report {i}", message="Hello " * 50, schedule_option="weekly",
+                                 start_date=start + timedelta(hours=i), token="ya29.bench"))
+    session.commit()
+    session.close()
+
+    client = web.app.test_client()
+    with web.app.test_request_context():
+        assets = [web.url_for("static", filename=name) for name in ASSETS]
+    return web, client, assets
+
+
+def measure_before(root: str, jobs: int, requests: int, accept: str) -> None:
+    """Print bytes per visit and render time of the app under root as JSON."""
+    _, client, assets = load_app(root, jobs)
+    headers = {"Accept-Encoding": accept}
+    page, _ = timed(client, "/", headers)
+    visit_bytes = len(page.data) + sum(len(client.get(a, headers=headers).data) for a in assets)
+    times = [timed(client, "/", headers)[1] for _ in range(requests)]
+    print(json.dumps({"bytes": visit_bytes, "median": statistics.median(times)}))
+
+
+def run_before(rev: str, jobs: int, requests: int, accept: str) -> dict:
+    """Check out rev into a temporary directory and measure it in a separate process."""
+    checkout = tempfile.mkdtemp()
+    archive = subprocess.run(["git", "-C", ROOT, "archive", rev], check=True, capture_output=True).stdout
+    subprocess.run(["tar", "-x", "-C", checkout], input=archive, check=True)
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure-before", checkout,
+                          "--jobs", str(jobs), "--requests", str(requests), "--accept", accept],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--before-rev", help="commit to measure as 'before' (default: the first commit)")
+    parser.add_argument("--brotli", action="store_true", help="also accept br, if brotli is installed")
+    parser.add_argument("--measure-before", metavar="ROOT", help=argparse.SUPPRESS)
+    parser.add_argument("--accept", default="gzip", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    accept = "br, gzip" if args.brotli else "gzip"
+
+    if args.measure_before:
+        measure_before(args.measure_before, args.jobs, args.requests, args.accept)
+        return
+    rev = args.before_rev or subprocess.run(["git", "-C", ROOT, "rev-list", "--max-parents=0", "HEAD"], check=True,
+                                            capture_output=True, text=True).stdout.split()[0]
+    before = run_before(rev, args.jobs, args.requests, accept)
+
+    web, client, assets = load_app(ROOT, args.jobs)
+    from src.caching import caching
+    if args.brotli and caching.brotli is None:
+        print("brotli is not installed; measuring gzip only")
+        accept = "gzip"
+
+    # After, first visit: compressed page and compressed, immutable assets
+    accept = {"Accept-Encoding": accept}
+    page, _ = timed(client, "/", accept)
+    first_bytes = len(page.data) + sum(len(client.get(a, headers=accept).data) for a in assets)
+    etag = page.headers["ETag"]
+
+    # After, repeat visit: assets come from the browser cache, the page revalidates
+    repeat = dict(accept, **{"If-None-Match": etag})
+    repeat_resp, _ = timed(client, "/", repeat)
+    assert repeat_resp.status_code == 304, repeat_resp.status_code
+    repeat_times = [timed(client, "/", repeat)[1] for _ in range(args.requests)]
+
+    print(f"jobs={args.jobs} before={rev[:7]} accept-encoding={accept['Accept-Encoding']}")
+    print(f"before:        {before['bytes']:>7} bytes/visit  render median {before['median'] * 1000:.2f}ms")
+    print(f"after, first:  {first_bytes:>7} bytes/visit")
+    print(f"after, repeat: {len(repeat_resp.data):>7} bytes/visit  304 median {statistics.median(repeat_times) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
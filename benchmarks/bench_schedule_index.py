@@ -0,0 +1,115 @@
+"""
+Benchmark resident memory and build time of the schedule index against one ORM object per job.
+
+Usage:
+    python -m benchmarks.bench_schedule_index [--jobs 1000000] [--db /tmp/bench_jobs.db] [--adds 2000]
+
+Each approach runs in its own subprocess so peak RSS is measured in isolation.
+After building, the index run also times --adds add() and remove() calls, as made
+by the /send and /cancel routes.
+The ORM figure only counts the loaded ScheduledJob instances, not the thread per job
+that the previous scheduler also started.
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+def rss_mb() -> float:
+    """Return peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def populate(jobs: int) -> None:
+    """Fill the database with synthetic jobs of realistic size."""
+    from src.models.models import ScheduledJob, engine, init_db
+    from src.scheduler.scheduler import INTERVAL_SECONDS
+    init_db()
+    options = list(INTERVAL_SECONDS)
+    start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    message = "Hello,\n\nThis is your scheduled reminder. " * 20
+    batch = []
+    with engine.begin() as conn:
+        for i in range(jobs):
+            batch.append(dict(
+                id=str(uuid.uuid4()),
+                user_email=f"user{i % 10000}@example.com",
+                to_address=f"recipient{i}@example.com",
+                subject=f"Reminder {i}",
+                message=message,
+                schedule_option=options[i % len(options)],
+                start_date=start + timedelta(minutes=i % 1440),
+                token="ya29." + "x" * 160,
+                refresh_token="1//" + "y" * 100,
+                attachments=None,
+            ))
+            if len(batch) == 10000:
+                conn.execute(ScheduledJob.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(ScheduledJob.__table__.insert(), batch)
+
+
+def run_orm() -> None:
+    from src.models.models import ScheduledJob, Session
+    base = rss_mb()
+    started = time.perf_counter()
+    session = Session()
+    jobs = session.query(ScheduledJob).all()
+    elapsed = time.perf_counter() - started
+    print(f"orm    jobs={len(jobs)} build={elapsed:.2f}s rss_delta={rss_mb() - base:.0f}MB")
+
+
+def run_index(adds: int) -> None:
+    from src.models.models import Session
+    from src.scheduler.schedule_index import ScheduleIndex
+    base = rss_mb()
+    started = time.perf_counter()
+    session = Session()
+    index = ScheduleIndex()
+    count = index.build(session)
+    session.close()
+    elapsed = time.perf_counter() - started
+    print(f"index  jobs={count} build={elapsed:.2f}s rss_delta={rss_mb() - base:.0f}MB "
+          f"arrays={index.nbytes() / 2**20:.0f}MB")
+    start = datetime.now() + timedelta(days=1)
+    for name, calls in (("add", [(index.add, str(uuid.uuid4()), start, "weekly") for _ in range(adds)]),
+                        ("remove", [(index.remove, key.hex()) for key in (bytes(index._ids[i * 16:(i + 1) * 16])
+                                                                          for i in range(adds))])):
+        times = []
+        for func, *call_args in calls:
+            started = time.perf_counter()
+            func(*call_args)
+            times.append(time.perf_counter() - started)
+        times.sort()
+        print(f"index  {name} n={adds} median={times[adds // 2] * 1e6:.0f}us max={times[-1] * 1e3:.2f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=1000000)
+    parser.add_argument("--db", default="/tmp/bench_jobs.db")
+    parser.add_argument("--adds", type=int, default=2000)
+    parser.add_argument("--mode", choices=["orm", "index"])
+    args = parser.parse_args()
+    if args.mode:
+        run_orm() if args.mode == "orm" else run_index(args.adds)
+        return
+    env = dict(os.environ, DB_PATH=f"sqlite:///{args.db}")
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    subprocess.run([sys.executable, "-c", f"from benchmarks.bench_schedule_index import populate; populate({args.jobs})"],
+                   env=env, check=True)
+    for mode in ("orm", "index"):
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_schedule_index", "--mode", mode, "--adds", str(args.adds)],
+                       env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
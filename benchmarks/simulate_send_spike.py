@@ -0,0 +1,123 @@
+"""
+Simulate a spike of jobs all due at 09:00 going through the admission controller.
+
+Usage:
+    python -m benchmarks.simulate_send_spike [--jobs 100000] [--users 10000] [--heavy-jobs 20000] [--send-now 100]
+
+Runs on a virtual clock against a fake Gmail API that enforces the per-user
+(250 units/s, 15,000 units/min) and per-project (1,200,000 units/min) quotas,
+with messages.send costing 100 units. Jobs not yet admitted stay in the schedule
+backlog, as they would in the schedule index, and jobs refused because their user's
+queue is full go back into it until the controller's retry delay has passed.
+
+Besides --jobs spread evenly over --users, one extra user has --heavy-jobs jobs due
+at the same time, and they are queued ahead of everyone else's. Lateness of the
+other users' sends is reported separately.
+"""
+
+import argparse
+import heapq
+import random
+from collections import deque
+from datetime import datetime
+from src.scheduler.admission import AdmissionController, PRIORITY_NOW
+
+SEND_UNITS = 100
+HEAVY_USER = "heavy@example.com"
+
+
+class FakeGmail:
+    """Counts sends that would have exceeded the Gmail API quotas."""
+
+    def __init__(self) -> None:
+        self.user_second = {}
+        self.user_minute = {}
+        self.project_minute = deque()
+        self.quota_errors = 0
+
+    @staticmethod
+    def _window(sends: deque, now: float, seconds: float) -> deque:
+        while sends and sends[0] <= now - seconds:
+            sends.popleft()
+        return sends
+
+    def send(self, user: str, now: float):
+        second = self._window(self.user_second.setdefault(user, deque()), now, 1)
+        minute = self._window(self.user_minute.setdefault(user, deque()), now, 60)
+        project = self._window(self.project_minute, now, 60)
+        if ((len(second) + 1) * SEND_UNITS > 250 or (len(minute) + 1) * SEND_UNITS > 15000
+                or (len(project) + 1) * SEND_UNITS > 1200000):
+            self.quota_errors += 1
+            return False, "HttpError 429: rateLimitExceeded"
+        second.append(now)
+        minute.append(now)
+        project.append(now)
+        return True, None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--heavy-jobs", type=int, default=20000, help="jobs of one extra user, due at the same time")
+    parser.add_argument("--send-now", type=int, default=100, help="send-now requests issued during the spike")
+    args = parser.parse_args()
+
+    spike = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0).timestamp()
+    clock = [spike]
+    rng = random.Random(0)
+    controller = AdmissionController(clock=lambda: clock[0], rng=rng.random)
+    gmail = FakeGmail()
+    users = [HEAVY_USER] * args.heavy_jobs + [f"user{i % args.users}@example.com" for i in range(args.jobs)]
+    backlog = [(spike, seq, user) for seq, user in enumerate(users)]  # (due at, order, user)
+    send_now_at = deque(sorted(spike + rng.uniform(0, 300) for _ in range(args.send_now)))
+    send_now_lateness = []
+    other_lateness = []
+    refused = 0
+    max_pending = 0
+
+    while backlog or send_now_at or len(controller):
+        now = clock[0]
+        while send_now_at and send_now_at[0] <= now:
+            send_now_at.popleft()
+            controller.submit("urgent@example.com", None, priority=PRIORITY_NOW)
+        while backlog and backlog[0][0] <= now:
+            _, seq, user = backlog[0]
+            if controller.submit(user, None, planned=spike, block=False) is not None:
+                heapq.heappop(backlog)
+            elif controller.user_pending(user) >= controller.max_user_pending:
+                refused += 1
+                heapq.heapreplace(backlog, (now + controller.retry_delay(user), seq, user))
+            else:
+                break  # queue full; the dispatcher would block here
+        max_pending = max(max_pending, len(controller))
+        item, wait = controller.next_ready(now)
+        if item is None:
+            next_event = now + wait if wait is not None else float("inf")
+            if send_now_at:
+                next_event = min(next_event, send_now_at[0])
+            if backlog and backlog[0][0] > now:
+                next_event = min(next_event, backlog[0][0])
+            clock[0] = max(next_event, now + 1e-6)
+            continue
+        ok, err = gmail.send(item.user, now)
+        if item.priority == PRIORITY_NOW:
+            send_now_lateness.append(now - item.planned)
+        elif ok and item.user != HEAVY_USER:
+            other_lateness.append(now - item.planned)
+        controller.finish(item, now, ok, err)
+
+    stats = controller.stats.snapshot()
+    print(f"jobs={args.jobs} users={args.users} drained_in={clock[0] - spike:.0f}s max_pending={max_pending}")
+    print("lateness: " + " ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()))
+    other_lateness.sort()
+    print(f"other users: n={len(other_lateness)} "
+          f"p50_lateness={other_lateness[len(other_lateness) // 2] if other_lateness else 0:.1f}s "
+          f"max_lateness={other_lateness[-1] if other_lateness else 0:.1f}s")
+    print(f"heavy user: jobs={args.heavy_jobs} refused_submissions={refused}")
+    print(f"send_now: n={len(send_now_lateness)} max_lateness={max(send_now_lateness, default=0):.2f}s")
+    print(f"fake gmail quota errors={gmail.quota_errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,11 +31,25 @@ logging.getLogger().addHandler(file_handler)
 from typing import List, Optional, Dict, Any
 from flask_dance.contrib.google import google
 from src.models.models import ScheduledJob, Session, init_db
-from src.email.email_utils import hash_value, validate_email, validate_schedule_option
-from src.scheduler.scheduler import schedule_email_job
+from src.email.email_utils import hash_value, validate_email, validate_schedule_option, parse_start_date
+from src.scheduler.schedule_index import schedule_index
+from src.scheduler.admission import admission, PRIORITY_NOW, SEND_NOW_TIMEOUT_SECONDS
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from src.auth.auth import blueprint as google_blueprint
+from src.caching.caching import init_app as init_caching, bump_jobs_version, get_jobs_version, make_etag, to_http_date
+from werkzeug.http import is_resource_modified
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# Step between runs for each schedule option, as shown on the dashboard
+RUN_STEPS = {
+	"hourly": timedelta(hours=1),
+	"daily": timedelta(days=1),
+	"weekly": timedelta(weeks=1),
+	"monthly": timedelta(days=30),
+	"three_monthly": timedelta(days=90),
+	"yearly": timedelta(days=365),
+}
 
 
 # Set correct template and static folder paths
@@ -46,6 +60,7 @@ app = Flask(
 )
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'supersekrit')
 app.register_blueprint(google_blueprint, url_prefix="/login")
+static_assets = init_caching(app)
 
 init_db()
 
@@ -105,6 +120,11 @@ def edit(job_id: str):
 			flash('Invalid schedule option.')
 			session.close()
 			return redirect(url_for('edit', job_id=job_id))
+		start_dt = parse_start_date(start_date, start_time)
+		if start_dt is None:
+			flash('Invalid start date.')
+			session.close()
+			return redirect(url_for('edit', job_id=job_id))
 		if not validate_email(to_address):
 			flash('Invalid email address.')
 			session.close()
@@ -126,9 +146,11 @@ def edit(job_id: str):
 		job.subject = subject
 		job.message = message
 		job.schedule_option = schedule_option
-		job.start_date = datetime.strptime(start_date + " " + start_time, "%Y-%m-%d %H:%M")
+		job.start_date = start_dt
 		job.attachments = ','.join(attachment_paths) if attachment_paths else None
+		bump_jobs_version(session, job.user_email)
 		session.commit()
+		schedule_index.add(job.id, job.start_date, job.schedule_option)
 		session.close()
 		flash('Scheduled email updated.')
 		return redirect(url_for('index'))
@@ -189,8 +211,16 @@ def send_now(job_id: str):
 		return redirect(url_for("index"))
 	# Pass attachment paths to send_email_gmail_api
 	attachments = job.attachments.split(',') if job.attachments else []
-	ok, err = send_email_gmail_api(token, to_address, subject, message, attachments=attachments, refresh_token=refresh_token)
+	user_email = job.user_email
 	session.close()
+	# Go through admission control ahead of scheduled sends so bursts stay within Gmail quotas
+	admission.start()
+	future = admission.submit(user_email, lambda: send_email_gmail_api(token, to_address, subject, message, attachments=attachments, refresh_token=refresh_token), priority=PRIORITY_NOW)
+	try:
+		ok, err = future.result(timeout=SEND_NOW_TIMEOUT_SECONDS)
+	except FutureTimeoutError:
+		flash("Email queued. It will be sent shortly.")
+		return redirect(url_for("index"))
 	if ok:
 		flash("Email sent immediately.")
 		return redirect(url_for("index"))
@@ -240,57 +270,66 @@ def index():
 		flash("Session expired or permission revoked. Please log in again.")
 		return redirect(url_for("google.login"))
 	email = resp.json()["email"]
-	jobs = get_user_jobs(email)
 	import json
 	# Calculate next run for each job
-	def calc_next_run(job: Any) -> Any:
-		"""Calculate the next scheduled run datetime for a job."""
-		from datetime import datetime, timedelta, date
-		now = datetime.now()
+	def parse_start(job: Any) -> datetime:
+		"""Return the job's start date as a datetime, parsing legacy string values."""
 		start = job.start_date
 		if isinstance(start, str):
 			try:
 				start = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
 			except Exception:
 				start = datetime.strptime(start, "%Y-%m-%d")
+		return start
+	def calc_next_run(job: Any) -> Any:
+		"""Calculate the next scheduled run datetime for a job."""
+		now = datetime.now()
+		start = parse_start(job)
 		# If first run is in the future
 		if start > now:
 			return start
 		# Otherwise, calculate next occurrence
-		option = job.schedule_option
+		step = RUN_STEPS.get(job.schedule_option)
 		dt = start
-		while dt <= now:
-			if option == "hourly":
-				dt += timedelta(hours=1)
-			elif option == "daily":
-				dt += timedelta(days=1)
-			elif option == "weekly":
-				dt += timedelta(weeks=1)
-			elif option == "monthly":
-				dt += timedelta(days=30)
-			elif option == "three_monthly":
-				dt += timedelta(days=90)
-			elif option == "yearly":
-				dt += timedelta(days=365)
-			else:
-				break
+		while dt <= now and step:
+			dt += step
 		return dt
-	jobs_with_next = []
-	for job in jobs:
-		# Fix Tagify JSON for old jobs
-		to_addr = job.to_address
-		if to_addr and to_addr.strip().startswith('['):
-			try:
-				tagify_data = json.loads(to_addr)
-				if isinstance(tagify_data, list) and all('value' in item for item in tagify_data):
-					to_addr = ','.join(item['value'] for item in tagify_data)
-			except json.JSONDecodeError:
-				pass  # If not valid JSON, leave as is
-			# If another error occurs, let it propagate (fail fast)
-		job.to_address = to_addr
-		next_run = calc_next_run(job)
-		jobs_with_next.append({"job": job, "next_run": next_run})
-	return render_template("index.html", email=email, jobs=jobs_with_next)
+	# Answer repeat visits with 304 Not Modified unless the jobs changed or a job ran since
+	db_session = Session()
+	version, updated_at = get_jobs_version(db_session, email)
+	schedule = db_session.query(ScheduledJob.start_date, ScheduledJob.schedule_option).filter_by(user_email=email).all()
+	db_session.close()
+	next_runs = [calc_next_run(row) for row in schedule]
+	# A job has run if the occurrence before its next run is not before its start date
+	last_runs = [run - RUN_STEPS[row.schedule_option] for row, run in zip(schedule, next_runs)
+				 if row.schedule_option in RUN_STEPS and run - RUN_STEPS[row.schedule_option] >= parse_start(row)]
+	last_modified = to_http_date(max([updated_at] + last_runs))
+	etag = make_etag(email, version, min(next_runs, default=None), static_assets.fingerprint())
+	if not session.get('_flashes') and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+		resp = make_response('', 304)
+	else:
+		jobs = get_user_jobs(email)
+		jobs_with_next = []
+		for job in jobs:
+			# Fix Tagify JSON for old jobs
+			to_addr = job.to_address
+			if to_addr and to_addr.strip().startswith('['):
+				try:
+					tagify_data = json.loads(to_addr)
+					if isinstance(tagify_data, list) and all('value' in item for item in tagify_data):
+						to_addr = ','.join(item['value'] for item in tagify_data)
+				except json.JSONDecodeError:
+					pass  # If not valid JSON, leave as is
+				# If another error occurs, let it propagate (fail fast)
+			job.to_address = to_addr
+			next_run = calc_next_run(job)
+			jobs_with_next.append({"job": job, "next_run": next_run})
+		resp = make_response(render_template("index.html", email=email, jobs=jobs_with_next))
+	resp.set_etag(etag, weak=True)
+	resp.last_modified = last_modified
+	resp.cache_control.private = True
+	resp.cache_control.no_cache = True
+	return resp
 
 @app.route("/send", methods=["POST"])
 def send():
@@ -317,6 +356,10 @@ def send():
 	if not validate_schedule_option(schedule_option):
 		flash('Invalid schedule option.')
 		return redirect(url_for('index'))
+	start_dt = parse_start_date(start_date, start_time)
+	if start_dt is None:
+		flash('Invalid start date.')
+		return redirect(url_for('index'))
 	if not hash_addr and not validate_email(to_address):
 		flash('Invalid email address.')
 		return redirect(url_for('index'))
@@ -337,8 +380,6 @@ def send():
 			attachment_paths.append(save_path)
 	# Store job in database
 	session = Session()
-	# Combine start_date and start_time into a datetime
-	start_dt = datetime.strptime(start_date + " " + start_time, "%Y-%m-%d %H:%M")
 	job = ScheduledJob(
 		id=job_id,
 		user_email=email,
@@ -352,7 +393,9 @@ def send():
 		attachments=','.join(attachment_paths) if attachment_paths else None
 	)
 	session.add(job)
+	bump_jobs_version(session, email)
 	session.commit()
+	schedule_index.add(job_id, start_dt, schedule_option)
 	session.close()
 	flash('Email scheduled!')
 	return redirect(url_for('index'))
@@ -368,7 +411,9 @@ def cancel(job_id: str):
 	job = session.query(ScheduledJob).filter_by(id=job_id, user_email=email).first()
 	if job:
 		session.delete(job)
+		bump_jobs_version(session, email)
 		session.commit()
+		schedule_index.remove(job_id)
 		flash('Scheduled email canceled.')
 	session.close()
 	return redirect(url_for('index'))
@@ -398,12 +443,12 @@ def logout():
 	return resp
 
 def start_all_jobs():
-	"""Load all jobs from database and start their schedulers when the app starts."""
+	"""Load all jobs from database into the schedule index and start its dispatcher when the app starts."""
 	session = Session()
-	jobs = session.query(ScheduledJob).all()
-	for job in jobs:
-		schedule_email_job(job, lambda j: j.token)
+	count = schedule_index.build(session)
 	session.close()
+	logging.info("Scheduled %d jobs", count)
+	schedule_index.start()
 
 if __name__ == "__main__":
 	logging.info("FLASK_SECRET_KEY: %s", app.secret_key)
@@ -0,0 +1 @@
+# caching package for Email Scheduler
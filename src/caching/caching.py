@@ -0,0 +1,194 @@
+"""
+HTTP caching and compression for the Email Scheduler app.
+
+- Dashboard validators come from a per-user jobs version that is bumped whenever
+  the user's jobs change.
+- Static asset URLs carry a content hash (?v=...) and are cached as immutable.
+- Text responses are compressed with brotli (if installed) or gzip; static files
+  are compressed once and kept in memory.
+"""
+
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+from flask import Flask, Response, request
+from werkzeug.security import safe_join
+from src.models.models import UserJobsVersion
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+# One year, the conventional maximum for immutable assets
+STATIC_MAX_AGE = 31536000
+
+
+def bump_jobs_version(session: Any, user_email: str) -> None:
+    """Mark the user's jobs as changed so cached dashboards are revalidated. The caller commits."""
+    row = session.query(UserJobsVersion).filter_by(user_email=user_email).first()
+    if row is None:
+        row = UserJobsVersion(user_email=user_email, version=0)
+        session.add(row)
+    row.version += 1
+    row.updated_at = datetime.now().replace(microsecond=0)
+
+
+def get_jobs_version(session: Any, user_email: str) -> Tuple[int, datetime]:
+    """Return the user's jobs version and when it last changed; version 0 at the epoch if never bumped."""
+    row = session.query(UserJobsVersion).filter_by(user_email=user_email).first()
+    if row is None:
+        return 0, datetime.fromtimestamp(0)
+    return row.version, row.updated_at
+
+
+def make_etag(*parts: Any) -> str:
+    """Build an entity tag from the given parts."""
+    return hashlib.sha1(':'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def to_http_date(value: datetime) -> datetime:
+    """Convert a naive local datetime, as stored by the app, to UTC for HTTP headers."""
+    return value.astimezone(timezone.utc)
+
+
+def choose_encoding(available: Tuple[str, ...] = ('br', 'gzip')) -> Optional[str]:
+    """Return the preferred content coding accepted by the client, or None."""
+    accepted = request.accept_encodings
+    for encoding in available:
+        if (encoding != 'br' or brotli is not None) and accepted[encoding]:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compress data with the given content coding."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+
+
+class StaticAsset:
+    """Content hash and pre-compressed bodies of one static file."""
+    __slots__ = ('mtime', 'version', 'encoded')
+
+    def __init__(self, path: str, mimetype: Optional[str]) -> None:
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.version = hashlib.sha256(data).hexdigest()[:12]
+        self.encoded: Dict[str, bytes] = {}
+        if mimetype in COMPRESSIBLE_MIMETYPES and len(data) >= MIN_COMPRESS_SIZE:
+            for encoding in ('br', 'gzip'):
+                if encoding == 'br' and brotli is None:
+                    continue
+                body = compress(data, encoding)
+                if len(body) < len(data):
+                    self.encoded[encoding] = body
+
+
+class StaticAssets:
+    """Cache of StaticAsset entries, refreshed when a file changes on disk."""
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename: str) -> Optional[StaticAsset]:
+        """Return the asset for a path relative to the static folder, or None if it does not exist."""
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        mtime = os.path.getmtime(path)
+        asset = self._assets.get(filename)
+        if asset is None or asset.mtime != mtime:
+            with self._lock:
+                asset = StaticAsset(path, mimetypes.guess_type(filename)[0])
+                self._assets[filename] = asset
+        return asset
+
+    def fingerprint(self) -> str:
+        """Return a hash of all known asset versions, for validators of pages that link to them."""
+        return make_etag(*sorted(f"{name}={asset.version}" for name, asset in self._assets.items()))
+
+    def preload(self) -> None:
+        """Hash and compress every static file up front."""
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                self.get(os.path.relpath(os.path.join(root, name), self.folder).replace(os.sep, '/'))
+
+
+def init_app(app: Flask) -> StaticAssets:
+    """Register hashed static URLs, static caching headers and response compression on the app."""
+    assets = StaticAssets(app.static_folder)
+    assets.preload()
+
+    @app.url_defaults
+    def add_static_version(endpoint: str, values: Dict[str, Any]) -> None:
+        """Append the content hash to static URLs so they can be cached forever."""
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            asset = assets.get(values['filename'])
+            if asset is not None:
+                values['v'] = asset.version
+
+    @app.after_request
+    def cache_and_compress(response: Response) -> Response:
+        """Set caching headers on static files and compress text responses."""
+        if request.endpoint == 'static':
+            return _static_response(assets, response)
+        if (response.status_code == 200 and not response.direct_passthrough
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and 'Content-Encoding' not in response.headers):
+            response.vary.add('Accept-Encoding')
+            data = response.get_data()
+            encoding = choose_encoding()
+            if encoding and len(data) >= MIN_COMPRESS_SIZE:
+                # Low levels keep per-request CPU cost small for dynamic pages
+                response.set_data(compress(data, encoding, level=4 if encoding == 'br' else 6))
+                response.headers['Content-Encoding'] = encoding
+        return response
+
+    return assets
+
+
+def _static_response(assets: StaticAssets, response: Response) -> Response:
+    if response.status_code not in (200, 304):
+        return response
+    asset = assets.get(request.view_args['filename'])
+    if asset is None:
+        return response
+    if request.args.get('v') == asset.version:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    if not asset.encoded or response.status_code != 200:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(tuple(asset.encoded))
+    if encoding is None:
+        response.set_etag(asset.version)
+    else:
+        if hasattr(response.response, 'close'):
+            response.response.close()
+        response.direct_passthrough = False
+        response.set_data(asset.encoded[encoding])
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Accept-Ranges', None)
+        response.set_etag(f"{asset.version}-{encoding}")
+    return response.make_conditional(request)
@@ -8,6 +8,7 @@ import hashlib
 import re
 import logging
 from typing import Optional, Any, List
+from datetime import datetime
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
@@ -21,6 +22,10 @@ load_dotenv()
 
 EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
 
+# Range of start dates accepted from the schedule form
+MIN_START_DATE = datetime(1970, 1, 2)
+MAX_START_DATE = datetime(9000, 1, 1)
+
 def render_template_vars(text: str, now: Optional[Any] = None) -> str:
     """Replace {{time sent in ...}} and similar placeholders in text with formatted time."""
     import re
@@ -109,3 +114,13 @@ def validate_schedule_option(option):
     """Return True if the schedule option is valid."""
     allowed_options = {"hourly", "daily", "weekly", "monthly", "three_monthly", "yearly"}
     return option in allowed_options
+
+def parse_start_date(start_date: str, start_time: str) -> Optional[datetime]:
+    """Combine the form's start date and time into a datetime, or return None if invalid or out of range."""
+    try:
+        start_dt = datetime.strptime(start_date + " " + start_time, "%Y-%m-%d %H:%M")
+    except ValueError:
+        return None
+    if not MIN_START_DATE <= start_dt < MAX_START_DATE:
+        return None
+    return start_dt
@@ -5,7 +5,7 @@ Database models and job persistence for the Email Scheduler app.
 import os
 import logging
 from typing import Optional
-from sqlalchemy import create_engine, Column, String, DateTime, Text
+from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -28,6 +28,13 @@ class ScheduledJob(Base):
     refresh_token = Column(String, nullable=True)  # Google OAuth refresh token
     attachments = Column(Text, nullable=True)  # Comma-separated file paths
 
+class UserJobsVersion(Base):
+    """SQLAlchemy model counting changes to a user's scheduled jobs, used for dashboard caching."""
+    __tablename__ = 'user_jobs_versions'
+    user_email = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
 DB_PATH = os.environ.get('DB_PATH', 'sqlite:///jobs.db')
 engine = create_engine(DB_PATH)
 Session = sessionmaker(bind=engine)
@@ -0,0 +1,393 @@
+"""
+Admission control for outgoing emails in the Email Scheduler app.
+
+Scheduled sends are spread over a window after their planned time and throttled by
+per-user and global token buckets, so a burst of jobs due at the same minute stays
+inside the Gmail API quotas. Sends requested with "Send now" skip the spread and go
+ahead of scheduled sends. Each user has only a bounded number of scheduled sends
+queued at once; the rest stay in the schedule index until there is room.
+"""
+
+import os
+import math
+import heapq
+import random
+import threading
+import time
+import logging
+import itertools
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Gmail allows 250 quota units per user per second and messages.send costs 100,
+# so the per-user default stays under 2.5 sends per second.
+USER_SENDS_PER_SECOND = float(os.environ.get('USER_SENDS_PER_SECOND', '2'))
+USER_SEND_BURST = float(os.environ.get('USER_SEND_BURST', '1'))
+# The project quota is 1,200,000 units per minute, i.e. 200 sends per second.
+GLOBAL_SENDS_PER_SECOND = float(os.environ.get('GLOBAL_SENDS_PER_SECOND', '150'))
+GLOBAL_SEND_BURST = float(os.environ.get('GLOBAL_SEND_BURST', '150'))
+# Scheduled sends are jittered over this many seconds after their planned time
+SEND_SPREAD_SECONDS = float(os.environ.get('SEND_SPREAD_SECONDS', '120'))
+# Sends later than this are counted as over the lateness bound
+SEND_MAX_LATENESS_SECONDS = float(os.environ.get('SEND_MAX_LATENESS_SECONDS', '900'))
+# Scheduled submissions block once this many sends are waiting, not counting sends
+# parked behind their user's budget
+SEND_MAX_PENDING = int(os.environ.get('SEND_MAX_PENDING', '5000'))
+# Scheduled submissions for a user with this many sends waiting are refused, so one
+# busy user cannot fill the queue; the caller keeps them and submits them again later
+SEND_MAX_PENDING_PER_USER = int(os.environ.get('SEND_MAX_PENDING_PER_USER', '500'))
+SEND_WORKERS = int(os.environ.get('SEND_WORKERS', '8'))
+# Seconds a "Send now" request waits for its send before reporting it as queued
+SEND_NOW_TIMEOUT_SECONDS = float(os.environ.get('SEND_NOW_TIMEOUT_SECONDS', '10'))
+
+PRIORITY_NOW = 0
+PRIORITY_SCHEDULED = 1
+
+# Lateness histogram buckets start at 1s and grow by this factor, so percentiles are
+# accurate to within that factor, up to this multiple of the lateness bound
+LATENESS_BUCKET_GROWTH = 1.25
+LATENESS_BUCKET_RANGE = 64
+
+# A bucket this close to a whole token counts as having one, so rounding in the
+# refill cannot leave a send waiting for a sub-nanosecond remainder
+TOKEN_EPSILON = 1e-9
+
+QUOTA_ERROR_MARKERS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', '429')
+# Sends rejected for quota are retried this many times, backing off from this many seconds
+QUOTA_RETRY_LIMIT = 8
+QUOTA_BACKOFF_SECONDS = 1.0
+
+
+def is_quota_error(err: Optional[str]) -> bool:
+    """Return True if a send error means a Gmail rate limit or quota was hit."""
+    return bool(err) and any(marker in err for marker in QUOTA_ERROR_MARKERS)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second, holding at most capacity."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Return the seconds until a whole token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 - TOKEN_EPSILON else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """Consume one token."""
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        """Return True if the bucket is full and can be dropped."""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PendingSend:
+    """A send waiting for admission."""
+    __slots__ = ('user', 'planned', 'eligible', 'priority', 'attempts', 'send_func', 'future')
+
+    def __init__(self, user: str, planned: float, eligible: float, priority: int,
+                 send_func: Callable[[], Tuple[bool, Optional[str]]]) -> None:
+        self.user = user
+        self.planned = planned
+        self.eligible = eligible
+        self.priority = priority
+        self.attempts = 0
+        self.send_func = send_func
+        self.future: Future = Future()
+
+
+class LatenessStats:
+    """Running summary of how late sends were compared with their planned time."""
+
+    def __init__(self, max_lateness: float) -> None:
+        self.max_lateness = max_lateness
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.over_bound = 0
+        self.failures = 0
+        self.quota_errors = 0
+        self.retries = 0
+        edges = [1.0]
+        while edges[-1] < max_lateness * LATENESS_BUCKET_RANGE:
+            edges.append(edges[-1] * LATENESS_BUCKET_GROWTH)
+        self.edges = edges  # upper edge of each bucket; the last bucket is open-ended
+        self.histogram = [0] * (len(edges) + 1)
+
+    def record(self, lateness: float, ok: bool, err: Optional[str]) -> None:
+        """Record one finished send."""
+        lateness = max(lateness, 0.0)
+        self.count += 1
+        self.total += lateness
+        self.max = max(self.max, lateness)
+        if lateness > self.max_lateness:
+            self.over_bound += 1
+        self.histogram[bisect_right(self.edges, lateness)] += 1
+        if not ok:
+            self.failures += 1
+            if is_quota_error(err):
+                self.quota_errors += 1
+
+    def record_retry(self) -> None:
+        """Record a send that hit a quota and was queued again."""
+        self.quota_errors += 1
+        self.retries += 1
+
+    def percentile(self, p: float) -> float:
+        """Return the upper bucket edge below which p percent of sends fall."""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for edge, n in zip(self.edges + [self.max], self.histogram):
+            seen += n
+            if seen >= target:
+                return min(edge, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current metrics as a dict."""
+        return {
+            'sent': self.count,
+            'mean_lateness': self.total / self.count if self.count else 0.0,
+            'p50_lateness': self.percentile(50),
+            'p95_lateness': self.percentile(95),
+            'p99_lateness': self.percentile(99),
+            'max_lateness': self.max,
+            'over_bound': self.over_bound,
+            'failures': self.failures,
+            'quota_errors': self.quota_errors,
+            'retries': self.retries,
+        }
+
+
+class AdmissionController:
+    """Queue in front of the Gmail API enforcing send budgets, spread and priority."""
+
+    def __init__(self,
+                 user_rate: float = USER_SENDS_PER_SECOND,
+                 user_burst: float = USER_SEND_BURST,
+                 global_rate: float = GLOBAL_SENDS_PER_SECOND,
+                 global_burst: float = GLOBAL_SEND_BURST,
+                 spread: float = SEND_SPREAD_SECONDS,
+                 max_lateness: float = SEND_MAX_LATENESS_SECONDS,
+                 max_pending: int = SEND_MAX_PENDING,
+                 max_user_pending: int = SEND_MAX_PENDING_PER_USER,
+                 workers: int = SEND_WORKERS,
+                 clock: Callable[[], float] = time.time,
+                 rng: Callable[[], float] = random.random) -> None:
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.spread = min(spread, max_lateness)
+        self.max_pending = max_pending
+        self.max_user_pending = max_user_pending
+        self.workers = workers
+        self.clock = clock
+        self.rng = rng
+        self.stats = LatenessStats(max_lateness)
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._users: Dict[str, TokenBucket] = {}
+        self._queues: Tuple[list, list] = ([], [])  # one heap per priority
+        self._throttled: Dict[str, deque] = {}  # sends waiting for their user's budget
+        self._user_pending: Dict[str, int] = {}
+        self._pending = 0
+        self._parked = 0  # sends in _throttled
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: list = []
+        self._last_report = clock()
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def submit(self, user: str, send_func: Callable[[], Tuple[bool, Optional[str]]],
+               planned: Optional[float] = None, priority: int = PRIORITY_SCHEDULED,
+               block: bool = True) -> Optional[Future]:
+        """Queue a send and return a Future for its (ok, err) result.
+
+        Scheduled sends wait while the queue is full, or return None if block is False.
+        They also return None, without waiting, if the user already has max_user_pending
+        sends queued; see retry_delay. Sends with PRIORITY_NOW are always accepted.
+        """
+        with self._cond:
+            now = self.clock()
+            if planned is None:
+                planned = now
+            if priority != PRIORITY_NOW:
+                while True:
+                    if self.user_pending(user) >= self.max_user_pending:
+                        return None
+                    if self._pending - self._parked < self.max_pending:
+                        break
+                    if not block:
+                        return None
+                    self._cond.wait()
+            eligible = planned
+            if priority != PRIORITY_NOW:
+                eligible += self.rng() * self.spread
+            item = PendingSend(user, planned, eligible, priority, send_func)
+            heapq.heappush(self._queues[priority], (eligible, next(self._seq), item))
+            self._pending += 1
+            self._user_pending[user] = self.user_pending(user) + 1
+            self._cond.notify_all()
+            return item.future
+
+    def user_pending(self, user: str) -> int:
+        """Return how many of the user's sends are waiting."""
+        return self._user_pending.get(user, 0)
+
+    def retry_delay(self, user: str) -> float:
+        """Return how long to hold a refused send: until about half the user's queue has drained."""
+        return max(self.user_pending(user) / 2 / self.user_rate, 1.0)
+
+    def next_ready(self, now: float) -> Tuple[Optional[PendingSend], float]:
+        """Take the next send allowed at now, or return how long to wait for one.
+
+        A send whose user is out of budget is parked in that user's FIFO, and a single
+        wake-up entry for the user is queued at the time its next token arrives.
+        """
+        while True:
+            queue = None
+            for q in self._queues:
+                if q and q[0][0] <= now:
+                    queue = q
+                    break
+            if queue is None:
+                heads = [q[0][0] for q in self._queues if q]
+                return None, (min(heads) - now if heads else None)
+            wait = self._global.wait_time(now)
+            if wait > 0:
+                return None, wait
+            entry = heapq.heappop(queue)[2]
+            if isinstance(entry, str):
+                # Wake-up entry for a throttled user
+                user, item = entry, None
+                if user not in self._throttled:
+                    continue
+            else:
+                user, item = entry.user, entry
+                if user in self._throttled:
+                    if item.priority == PRIORITY_NOW:
+                        # Jump the user's own queue and wake it ahead of scheduled sends
+                        self._throttled[user].appendleft(item)
+                        self._push_wake(user, now, self._users[user].wait_time(now))
+                    else:
+                        self._throttled[user].append(item)
+                    self._parked += 1
+                    continue
+            bucket = self._users.get(user)
+            if bucket is None:
+                bucket = self._users[user] = TokenBucket(self.user_rate, self.user_burst, now)
+            wait = bucket.wait_time(now)
+            if wait > 0:
+                if item is not None:
+                    self._throttled[user] = deque([item])
+                    self._parked += 1
+                self._push_wake(user, now, wait)
+                continue
+            bucket.take(now)
+            self._global.take(now)
+            if item is None:
+                throttled = self._throttled[user]
+                item = throttled.popleft()
+                self._parked -= 1
+                if throttled:
+                    self._push_wake(user, now, bucket.wait_time(now))
+                else:
+                    del self._throttled[user]
+            self._pending -= 1
+            if self._user_pending[user] > 1:
+                self._user_pending[user] -= 1
+            else:
+                del self._user_pending[user]
+            return item, 0.0
+
+    def finish(self, item: PendingSend, started: float, ok: bool, err: Optional[str]) -> None:
+        """Record the outcome of a send admitted at started and resolve its Future.
+
+        Sends rejected for quota are queued again with exponential backoff, waiting at
+        least until the user's budget has a token, up to QUOTA_RETRY_LIMIT times.
+        """
+        with self._cond:
+            if not ok and is_quota_error(err) and item.attempts < QUOTA_RETRY_LIMIT:
+                item.attempts += 1
+                self.stats.record_retry()
+                wait = QUOTA_BACKOFF_SECONDS * 2 ** (item.attempts - 1)
+                bucket = self._users.get(item.user)
+                if bucket is not None:
+                    # Gmail disagrees with our budget; hold back the user's other sends too
+                    bucket.tokens = min(bucket.tokens, 0.0)
+                    wait = max(wait, bucket.wait_time(started))
+                item.eligible = started + wait
+                heapq.heappush(self._queues[item.priority], (item.eligible, next(self._seq), item))
+                self._pending += 1
+                self._user_pending[item.user] = self.user_pending(item.user) + 1
+                self._cond.notify_all()
+                return
+            self.stats.record(started - item.planned, ok, err)
+            if started - self._last_report >= 60:
+                self._last_report = started
+                self._prune_users(started)
+                logging.info("Send admission: pending=%d %s", len(self), self.stats.snapshot())
+        item.future.set_result((ok, err))
+
+    def start(self) -> None:
+        """Start the worker threads if they are not already running."""
+        with self._cond:
+            if self._threads:
+                return
+            for _ in range(self.workers):
+                t = threading.Thread(target=self._run, daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                now = self.clock()
+                parked = self._parked
+                item, wait = self.next_ready(now)
+                if item is None:
+                    if self._parked > parked:
+                        # Parked sends no longer count toward max_pending
+                        self._cond.notify_all()
+                    self._cond.wait(timeout=wait)
+                    continue
+                self._cond.notify_all()
+            try:
+                ok, err = item.send_func()
+            except Exception as e:
+                logging.exception("Send for %s failed", item.user)
+                ok, err = False, str(e)
+            self.finish(item, now, ok, err)
+
+    def _push_wake(self, user: str, now: float, wait: float) -> None:
+        # Always strictly after now, or next_ready would pop the entry again without the clock moving
+        at = max(now + wait, math.nextafter(now, math.inf))
+        priority = self._throttled[user][0].priority
+        heapq.heappush(self._queues[priority], (at, next(self._seq), user))
+
+    def _prune_users(self, now: float) -> None:
+        for user in [u for u, b in self._users.items() if u not in self._throttled and b.is_idle(now)]:
+            del self._users[user]
+
+
+admission = AdmissionController()
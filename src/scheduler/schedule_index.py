@@ -0,0 +1,384 @@
+"""
+Compact in-memory schedule index for the Email Scheduler app.
+
+Only the job id, next-fire time and interval code of each job are kept in memory,
+in flat arrays. The rest of the job (recipients, message, token, attachments) is
+loaded from the database when the job fires.
+"""
+
+import threading
+import time
+import uuid
+import logging
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.models.models import ScheduledJob, Session
+from src.email.email_utils import send_email_gmail_api
+from src.scheduler.scheduler import INTERVAL_SECONDS
+from src.scheduler.admission import admission
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Interval code stored per job; 0 means the job runs once
+INTERVAL_CODES = {option: code for code, option in enumerate(INTERVAL_SECONDS, start=1)}
+CODE_SECONDS = array('q', [0] + list(INTERVAL_SECONDS.values()))
+
+# Next-fire value of a row that holds no job
+FREE_ROW = -1
+
+ID_SIZE = 16
+EMPTY_ID = bytes(ID_SIZE)
+
+# Row of an entry in the sorted id column whose job has left the index
+NO_ROW = 0xFFFFFFFF
+# The dispatcher drops such entries from the sorted id column once there are more
+# than this many, and more than one per DEAD_ID_RATIO live jobs
+MIN_DEAD_IDS = 4096
+DEAD_ID_RATIO = 4
+
+# Most due jobs handed to the admission controller per dispatcher pass; also kept
+# under SQLite's default limit of 999 bound parameters for the IN (...) lookup
+DISPATCH_BATCH = 500
+
+
+def first_fire_time(start_date: Any, schedule_option: str, now: Optional[float] = None) -> Optional[int]:
+    """Return the first epoch second at or after now when the job should fire, or None if it never will."""
+    if now is None:
+        now = time.time()
+    if not isinstance(start_date, datetime):
+        # fallback for legacy data
+        start_date = datetime.combine(start_date, datetime.min.time())
+    fire = int(start_date.timestamp())
+    interval = INTERVAL_SECONDS.get(schedule_option)
+    if fire >= now:
+        return fire
+    if not interval:
+        return None
+    missed = int((now - fire) // interval) + 1
+    return fire + missed * interval
+
+
+def job_key(job_id: str) -> Optional[bytes]:
+    """Return the 16-byte key of a job id, or None if the id is not a UUID."""
+    try:
+        return uuid.UUID(job_id).bytes
+    except (TypeError, ValueError):
+        logging.warning("Job %r has a non-UUID id and cannot be scheduled", job_id)
+        return None
+
+
+def fire_job(job_id: str) -> Tuple[bool, Optional[str]]:
+    """Load a job from the database and send its email."""
+    session = Session()
+    job = session.query(ScheduledJob).filter_by(id=job_id).first()
+    session.close()
+    if not job or not job.token:
+        return False, "Job not found or has no token."
+    attachments = job.attachments.split(',') if job.attachments else []
+    ok, err = send_email_gmail_api(job.token, job.to_address, job.subject, job.message,
+                                   attachments=attachments, refresh_token=job.refresh_token)
+    if not ok:
+        logging.error(f"Failed to send email: {err}")
+    return ok, err
+
+
+def admit_jobs(due: List[Tuple[str, int]]) -> List[Tuple[str, int, float]]:
+    """Queue due (job id, planned time) pairs behind the admission controller, which sends them within the Gmail quotas.
+
+    Returns (job id, planned time, retry at) for jobs refused because their user's queue is full.
+    """
+    session = Session()
+    users = dict(session.query(ScheduledJob.id, ScheduledJob.user_email)
+                 .filter(ScheduledJob.id.in_([job_id for job_id, _ in due])))
+    session.close()
+    admission.start()
+    refused = []
+    for job_id, planned in due:
+        user = users.get(job_id)
+        if user is None:
+            continue
+        if admission.submit(user, lambda job_id=job_id: fire_job(job_id), planned=planned) is None:
+            refused.append((job_id, planned, time.time() + admission.retry_delay(user)))
+    return refused
+
+
+class ScheduleIndex:
+    """Array-backed schedule of all jobs, fired by a single dispatcher thread."""
+
+    def __init__(self, fire_func: Callable[[List[Tuple[str, int]]], List[Tuple[str, int, float]]] = admit_jobs) -> None:
+        self._fire_func = fire_func
+        self._ids = bytearray()          # 16-byte UUID per row
+        self._next_fire = array('q')     # epoch seconds per row, FREE_ROW if unused
+        self._interval = array('B')      # interval code per row, see INTERVAL_CODES
+        self._free_rows = array('I')     # rows available for reuse
+        self._sorted_ids = bytearray()   # ids in byte order, for binary search ...
+        self._sorted_rows = array('I')   # ... and the row each belongs to, NO_ROW if freed
+        self._dead_ids = 0               # NO_ROW entries in the sorted column
+        self._heap_fire = array('q')     # min-heap of next-fire times ...
+        self._heap_row = array('I')      # ... and the row each entry belongs to
+        self._deferred: Dict[int, int] = {}  # planned time of rows held back by defer()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._next_fire) - len(self._free_rows)
+
+    def nbytes(self) -> int:
+        """Return the number of bytes held by the index arrays."""
+        return (len(self._ids)
+                + sum(a.itemsize * len(a) for a in (self._next_fire, self._interval, self._free_rows,
+                                                        self._sorted_rows, self._heap_fire, self._heap_row))
+                + len(self._sorted_ids))
+
+    def build(self, session: Any, batch_size: int = 10000, now: Optional[float] = None) -> int:
+        """Replace the index with every job in the database, streaming rows in batches. Returns the job count."""
+        if now is None:
+            now = time.time()
+        ids, next_fire, interval = bytearray(), array('q'), array('B')
+        # Canonical UUID strings sort like their bytes, so rows come out already in
+        # the order of the sorted id column
+        query = (session.query(ScheduledJob.id, ScheduledJob.start_date, ScheduledJob.schedule_option)
+                 .order_by(ScheduledJob.id).yield_per(batch_size))
+        in_order, last_key = True, b''
+        for job_id, start_date, schedule_option in query:
+            fire = first_fire_time(start_date, schedule_option, now)
+            if fire is None:
+                continue
+            key = job_key(job_id)
+            if key is None:
+                continue
+            if key <= last_key:
+                in_order = False
+            last_key = key
+            ids += key
+            next_fire.append(fire)
+            interval.append(INTERVAL_CODES.get(schedule_option, 0))
+        with self._cond:
+            self._ids, self._next_fire, self._interval = ids, next_fire, interval
+            self._free_rows = array('I')
+            self._deferred = {}
+            if in_order:
+                self._sorted_ids, self._sorted_rows = bytearray(ids), array('I', range(len(next_fire)))
+                self._dead_ids = 0
+            else:
+                self._rebuild_lookup()
+            self._rebuild_heap()
+            self._cond.notify()
+        return len(next_fire)
+
+    def add(self, job_id: str, start_date: Any, schedule_option: str) -> None:
+        """Schedule a job, replacing any existing entry for the same job id."""
+        fire = first_fire_time(start_date, schedule_option)
+        key = job_key(job_id)
+        if key is None:
+            return
+        with self._cond:
+            row = self._find_row(key)
+            if fire is None:
+                if row is not None:
+                    self._free(row)
+                return
+            if row is None:
+                row = self._new_row(key)
+            self._deferred.pop(row, None)
+            self._next_fire[row] = fire
+            self._interval[row] = INTERVAL_CODES.get(schedule_option, 0)
+            self._push(fire, row)
+            self._cond.notify()
+
+    def remove(self, job_id: str) -> None:
+        """Unschedule a job if it is in the index."""
+        key = job_key(job_id)
+        if key is None:
+            return
+        with self._cond:
+            row = self._find_row(key)
+            if row is not None:
+                self._free(row)
+
+    def defer(self, job_id: str, planned: int, at: float) -> None:
+        """Hold back a due job that could not be admitted; pop_due returns it again at `at` with its planned time."""
+        key = job_key(job_id)
+        if key is None:
+            return
+        with self._cond:
+            row = self._find_row(key)
+            if row is None:
+                # One-time jobs leave the index when popped
+                row = self._new_row(key)
+                self._interval[row] = 0
+            at = max(int(at), planned)
+            self._deferred[row] = planned
+            self._next_fire[row] = at
+            self._push(at, row)
+            self._cond.notify()
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Return (job id, planned fire time) for up to limit jobs due at now, advancing recurring jobs and dropping one-time jobs."""
+        if now is None:
+            now = time.time()
+        due = []
+        missed = 0
+        with self._cond:
+            while self._heap_fire and self._heap_fire[0] <= now and (limit is None or len(due) < limit):
+                fire, row = self._pop()
+                if self._next_fire[row] != fire:
+                    continue  # stale entry left by an edit or cancel
+                fire = self._deferred.pop(row, fire)
+                due.append((str(uuid.UUID(bytes=bytes(self._ids[row * ID_SIZE:(row + 1) * ID_SIZE]))), fire))
+                interval = CODE_SECONDS[self._interval[row]]
+                if interval:
+                    skipped = int((now - fire) // interval)
+                    missed += skipped
+                    fire += (skipped + 1) * interval
+                    self._next_fire[row] = fire
+                    self._push(fire, row)
+                else:
+                    self._free(row)
+            if len(self._heap_fire) > 2 * len(self) + 1024:
+                self._rebuild_heap()
+            if self._dead_ids > max(MIN_DEAD_IDS, len(self) // DEAD_ID_RATIO):
+                self._compact_lookup()
+        if missed:
+            logging.warning("Skipped %d occurrences of recurring jobs that were already overdue", missed)
+        return due
+
+    def start(self) -> None:
+        """Start the dispatcher thread if it is not already running."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            due = self.pop_due(limit=DISPATCH_BATCH)
+            if due:
+                try:
+                    for job_id, planned, at in self._fire_func(due):
+                        self.defer(job_id, planned, at)
+                except Exception:
+                    logging.exception("Dispatching %d scheduled jobs failed", len(due))
+            with self._cond:
+                if self._heap_fire:
+                    delay = self._heap_fire[0] - time.time()
+                    if delay > 0:
+                        self._cond.wait(timeout=delay)
+                else:
+                    self._cond.wait()
+
+    def _search(self, key: bytes) -> Tuple[int, bool]:
+        # Position of key in the sorted id column, and whether it is there
+        sorted_ids = self._sorted_ids
+        lo, hi = 0, len(self._sorted_rows)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if sorted_ids[mid * ID_SIZE:(mid + 1) * ID_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo, lo < len(self._sorted_rows) and sorted_ids[lo * ID_SIZE:(lo + 1) * ID_SIZE] == key
+
+    def _find_row(self, key: bytes) -> Optional[int]:
+        pos, found = self._search(key)
+        if found and self._sorted_rows[pos] != NO_ROW:
+            return self._sorted_rows[pos]
+        return None
+
+    def _rebuild_lookup(self) -> None:
+        ids = self._ids
+        rows = sorted((row for row, fire in enumerate(self._next_fire) if fire != FREE_ROW),
+                      key=lambda row: ids[row * ID_SIZE:(row + 1) * ID_SIZE])
+        sorted_ids = bytearray(len(rows) * ID_SIZE)
+        for i, row in enumerate(rows):
+            sorted_ids[i * ID_SIZE:(i + 1) * ID_SIZE] = ids[row * ID_SIZE:(row + 1) * ID_SIZE]
+        self._sorted_ids, self._sorted_rows = sorted_ids, array('I', rows)
+        self._dead_ids = 0
+
+    def _compact_lookup(self) -> None:
+        # Drop NO_ROW entries in place, keeping the order
+        sorted_ids, sorted_rows = self._sorted_ids, self._sorted_rows
+        kept = 0
+        for pos, row in enumerate(sorted_rows):
+            if row == NO_ROW:
+                continue
+            if kept != pos:
+                sorted_ids[kept * ID_SIZE:(kept + 1) * ID_SIZE] = sorted_ids[pos * ID_SIZE:(pos + 1) * ID_SIZE]
+                sorted_rows[kept] = row
+            kept += 1
+        del sorted_ids[kept * ID_SIZE:]
+        del sorted_rows[kept:]
+        self._dead_ids = 0
+
+    def _new_row(self, key: bytes) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self._ids[row * ID_SIZE:(row + 1) * ID_SIZE] = key
+        else:
+            self._ids += key
+            self._next_fire.append(FREE_ROW)
+            self._interval.append(0)
+            row = len(self._next_fire) - 1
+        pos, found = self._search(key)
+        if found:
+            # Reuse the entry left when the job last left the index
+            self._sorted_rows[pos] = row
+            self._dead_ids -= 1
+        else:
+            self._sorted_ids[pos * ID_SIZE:pos * ID_SIZE] = key
+            self._sorted_rows.insert(pos, row)
+        return row
+
+    def _free(self, row: int) -> None:
+        self._deferred.pop(row, None)
+        pos, found = self._search(bytes(self._ids[row * ID_SIZE:(row + 1) * ID_SIZE]))
+        if found:
+            self._sorted_rows[pos] = NO_ROW
+            self._dead_ids += 1
+        self._ids[row * ID_SIZE:(row + 1) * ID_SIZE] = EMPTY_ID
+        self._next_fire[row] = FREE_ROW
+        self._free_rows.append(row)
+
+    def _rebuild_heap(self) -> None:
+        # Rows sorted by next-fire time form a valid min-heap
+        next_fire = self._next_fire
+        rows = sorted((row for row, fire in enumerate(next_fire) if fire != FREE_ROW), key=next_fire.__getitem__)
+        self._heap_row = array('I', rows)
+        self._heap_fire = array('q', (next_fire[row] for row in rows))
+
+    def _push(self, fire: int, row: int) -> None:
+        heap_fire, heap_row = self._heap_fire, self._heap_row
+        heap_fire.append(fire)
+        heap_row.append(row)
+        pos = len(heap_fire) - 1
+        while pos:
+            parent = (pos - 1) >> 1
+            if heap_fire[parent] <= fire:
+                break
+            heap_fire[pos], heap_row[pos] = heap_fire[parent], heap_row[parent]
+            pos = parent
+        heap_fire[pos], heap_row[pos] = fire, row
+
+    def _pop(self) -> Tuple[int, int]:
+        heap_fire, heap_row = self._heap_fire, self._heap_row
+        top = heap_fire[0], heap_row[0]
+        fire, row = heap_fire.pop(), heap_row.pop()
+        size = len(heap_fire)
+        if not size:
+            return top
+        pos, child = 0, 1
+        while child < size:
+            if child + 1 < size and heap_fire[child + 1] < heap_fire[child]:
+                child += 1
+            if fire <= heap_fire[child]:
+                break
+            heap_fire[pos], heap_row[pos] = heap_fire[child], heap_row[child]
+            pos, child = child, 2 * child + 1
+        heap_fire[pos], heap_row[pos] = fire, row
+        return top
+
+
+schedule_index = ScheduleIndex()